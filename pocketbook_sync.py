@@ -1,14 +1,215 @@
 #!/usr/bin/env python3
 import argparse
+import calendar
+import codecs
 import os
-import json
 import hashlib
+import html
 import re
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
 from datetime import datetime
-from bs4 import BeautifulSoup
-from typing import List, Dict, Tuple, Optional
+import lxml.html as LH
+from lxml import etree
+from lxml.html import soupparser
+from selectolax.lexbor import LexborHTMLParser
+from typing import List, Dict, Tuple, Optional, Callable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# Below this many files the process pool startup costs more than it saves
+PARALLEL_THRESHOLD = 8
+
+# PocketBook writes the <h1> near the top, so only this many bytes are peeked
+TITLE_PEEK_BYTES = 16384
+
+# Readwise accepts up to this many highlights per request
+READWISE_BATCH_SIZE = 100
+
+# Concurrent uploads; matches the session's connection pool size
+UPLOAD_WORKERS = 4
+
+# (connect, read) timeouts for Readwise requests, in seconds
+READWISE_TIMEOUT = (5, 30)
+
+# Marks BLAKE2b highlight IDs; unprefixed IDs are MD5s from older caches
+HIGHLIGHT_ID_PREFIX = "b2:"
+
+# Read size for hashing on Pythons without hashlib.file_digest
+HASH_CHUNK_BYTES = 1 << 20
+
+_RE_H1 = re.compile(r'<h1[^>]*>(.*?)</h1>', re.DOTALL | re.IGNORECASE)
+_RE_TAG = re.compile(r'<[^>]+>')
+_RE_DIGITS = re.compile(r'\d+')
+# Bounds each field; days past the end of the month are left to _is_calendar_date
+_RE_DATE_TITLE = re.compile(
+    r'^(\d{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12]\d|3[01]) '
+    r'(?:[01]\d|2[0-3]):[0-5]\d:[0-5]\d) - (.+)$',
+    re.DOTALL
+)
+_RE_FILENAME_TITLE = re.compile(r'^\d{4}-\d{2}-\d{2}[ _]\d{2}[.:]\d{2}[.:]\d{2}\s*-\s*(.+)$')
+# First bm-color-* class token other than bm-color-none
+_RE_COLOR = re.compile(r'(?:^|\s)bm-color-(?!none(?:\s|$))(\S+)')
+_RE_CHARSET = re.compile(rb'charset=["\']?([\w-]+)', re.IGNORECASE)
+# Bytes cp1252 leaves undefined, on which the old decoder fell back to latin-1
+_RE_CP1252_UNDEFINED = re.compile(rb'[\x81\x8d\x8f\x90\x9d]')
+
+# Only the start of a file is searched for a <meta charset> declaration
+CHARSET_SNIFF_BYTES = 2048
+
+# Files above this size are streamed into lxml when they are valid UTF-8
+LARGE_FILE_BYTES = 256 * 1024
+STREAM_CHUNK_BYTES = 1 << 16
+
+
+def _has_class(name: str) -> str:
+    """XPath predicate matching a single token of the class attribute."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_HTML_PARSER = LH.HTMLParser(encoding='utf-8')
+
+_XP_H1 = etree.XPath("//h1")
+_XP_BOOKMARKS = etree.XPath(f"//div[{_has_class('bookmark')}]")
+_XP_SPAN = etree.XPath(".//span")
+_XP_PAGE = etree.XPath(f".//p[{_has_class('bm-page')}]")
+_XP_TEXT = etree.XPath(f".//div[{_has_class('bm-text')}]")
+_XP_NOTE = etree.XPath(f".//div[{_has_class('bm-note')}]")
+_XP_STRINGS = etree.XPath(".//text()")
+
+
+def _is_calendar_date(date_part: str) -> bool:
+    """Whether a "YYYY-MM-DD ..." string matched by _RE_DATE_TITLE names a real day."""
+    day = int(date_part[8:10])
+    return day <= 28 or day <= calendar.monthrange(int(date_part[:4]), int(date_part[5:7]))[1]
+
+
+def _get_text(elem) -> str:
+    """Same result as BeautifulSoup's get_text(strip=True)."""
+    return "".join(s.strip() for s in _XP_STRINGS(elem))
+
+
+def _parallel_map(func: Callable, items: List, *more_items: List) -> List:
+    """Map func over items, using a process pool for larger libraries."""
+    if len(items) <= PARALLEL_THRESHOLD:
+        return list(map(func, items, *more_items))
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        return list(pool.map(func, items, *more_items, chunksize=4))
+
+
+def _decode(raw: bytes, encoding: str, final: bool = True, errors: str = 'strict') -> str:
+    """bytes.decode that tolerates a character cut off at the end of a partial read."""
+    if final:
+        return raw.decode(encoding, errors)
+    return codecs.getincrementaldecoder(encoding)(errors).decode(raw)
+
+
+def _decode_html(raw: bytes, final: bool = True) -> Tuple[str, Optional[Tuple[str, str]]]:
+    """Decode notes file bytes, sniffing a BOM or a declared charset.
+    
+    Pass ``final=False`` for a head that may end mid-character. The second value
+    is ``(codec, legacy_codec)`` when the old utf-8/cp1252/latin-1 trial chain
+    would have decoded the bytes differently, otherwise None.
+    """
+    if raw.startswith(b'\xef\xbb\xbf'):
+        return _decode(raw[3:], 'utf-8', final, 'replace'), None
+    if raw.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return _decode(raw, 'utf-16', final, 'replace'), None
+    
+    # Valid UTF-8 is taken as-is; only then is a declared charset honoured
+    try:
+        return _decode(raw, 'utf-8', final), None
+    except UnicodeDecodeError:
+        pass
+    
+    legacy = 'iso8859-1' if _RE_CP1252_UNDEFINED.search(raw) else 'cp1252'
+    match = _RE_CHARSET.search(raw, 0, CHARSET_SNIFF_BYTES)
+    if match:
+        try:
+            declared = codecs.lookup(match.group(1).decode('ascii')).name
+            if declared != legacy:
+                return _decode(raw, declared, final), (declared, legacy)
+        except (LookupError, UnicodeDecodeError):
+            pass
+    return raw.decode(legacy), None
+
+
+def _transcode(text: str, codecs_used: Tuple[str, str]) -> Optional[str]:
+    """Turn decoded text into what the old trial chain read from the same bytes."""
+    codec, legacy = codecs_used
+    try:
+        return text.encode(codec).decode(legacy)
+    except UnicodeError:
+        return None
+
+
+def _read_text(html_file: Path) -> Tuple[str, Optional[Tuple[str, str]]]:
+    """Read a notes file in one go, decoding it exactly once."""
+    content, legacy = _decode_html(html_file.read_bytes())
+    # Match the newline handling of text-mode reads
+    return content.replace('\r\n', '\n').replace('\r', '\n'), legacy
+
+
+def _parse_utf8_stream(html_file: Path) -> Optional[etree._Element]:
+    """Feed a notes file to lxml in chunks, giving up if it isn't valid UTF-8."""
+    parser = LH.HTMLParser(encoding='utf-8')
+    # Validated alongside parsing so the result always matches _read_text
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(html_file, 'rb') as f:
+            while chunk := f.read(STREAM_CHUNK_BYTES):
+                decoder.decode(chunk)
+                parser.feed(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return None
+    return parser.close()
+
+
+def _peek_title(html_file: Path) -> Optional[str]:
+    """Scan the start of a notes file for the <h1> text without building a DOM."""
+    with open(html_file, 'rb') as f:
+        head = f.read(TITLE_PEEK_BYTES)
+    
+    # Decoded like the whole file so the title matches the parsed one
+    text, _ = _decode_html(head, final=len(head) < TITLE_PEEK_BYTES)
+    match = _RE_H1.search(text)
+    if not match:
+        return None
+    
+    return html.unescape(_RE_TAG.sub('', match.group(1))).strip()
+
+
+def _extract_title(html_file: Path) -> Tuple[Path, Optional[str]]:
+    """Read the book title from a notes file; runs in a worker process."""
+    try:
+        book_title = _peek_title(html_file)
+        
+        if book_title is None:
+            # Fall back to a full parse for files the regex can't handle
+            # (e.g. UTF-16 or a missing <h1>)
+            content, _ = _read_text(html_file)
+            
+            # selectolax is much cheaper than a full lxml/BeautifulSoup tree
+            # when all we need is one element
+            tree = LexborHTMLParser(content)
+            title_node = tree.css_first('h1') or tree.css_first('title')
+            if title_node:
+                book_title = title_node.text(strip=True)
+            else:
+                book_title = html_file.stem
+        
+        # Remove date prefix if present
+        if ' - ' in book_title:
+            book_title = book_title.split(' - ', 1)[1]
+        
+        return html_file, book_title
+    except Exception as e:
+        print(f"Error processing {html_file}: {e}")
+        return html_file, None
 
 
 class PocketBookReadwiseSync:
@@ -16,104 +217,178 @@ class PocketBookReadwiseSync:
         self.readwise_token = readwise_token
         self.cache_file = cache_file
         self.cache = self._load_cache()
+        # Membership is all sync() needs, so IDs live in a set (a list on disk)
+        self.synced_ids = set(self.cache.get("synced_ids", []))
+        # Migrate caches that stored per-highlight metadata
+        self.synced_ids.update(self.cache.pop("synced_highlights", {}))
+        # One entry per notes file; "hash" is only set once it has been synced
+        self.cache.setdefault("files", {})
+        # Migrate caches that kept file hashes in a map of their own; titles
+        # are cheap to read again
+        for path, entry in self.cache.pop("file_hashes", {}).items():
+            self.cache["files"].setdefault(path, {"hash": entry} if isinstance(entry, str) else entry)
+        self.cache.pop("file_titles", None)
         self.pocketbook_path = Path("/Volumes/PB700K3/Notes")
         self.readwise_url = "https://readwise.io/api/v2/highlights/"
         self.processed_files = []  # Track files processed during sync
         
+        # One keep-alive session for all uploads, retrying transient failures
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Token {readwise_token}",
+            "Content-Type": "application/json"
+        })
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"]
+        )
+        self.session.mount("https://", HTTPAdapter(pool_connections=UPLOAD_WORKERS, pool_maxsize=UPLOAD_WORKERS, max_retries=retry))
+        
     def _load_cache(self) -> Dict:
         if os.path.exists(self.cache_file):
-            with open(self.cache_file, 'r') as f:
-                return json.load(f)
-        return {"synced_highlights": {}, "file_hashes": {}}
+            return orjson.loads(Path(self.cache_file).read_bytes())
+        return {"synced_ids": [], "files": {}}
     
     def _save_cache(self):
-        with open(self.cache_file, 'w') as f:
-            json.dump(self.cache, f, indent=2)
+        self.cache["synced_ids"] = list(self.synced_ids)
+        # Compact output: the cache is machine state and can grow to many MB.
+        # Write it next to the real file and swap it in, so an interrupted
+        # save never leaves a truncated cache behind
+        tmp_file = f"{self.cache_file}.tmp"
+        Path(tmp_file).write_bytes(orjson.dumps(self.cache))
+        os.replace(tmp_file, self.cache_file)
     
     def _get_file_hash(self, filepath: Path) -> str:
         with open(filepath, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+            if hasattr(hashlib, 'file_digest'):
+                return hashlib.file_digest(f, 'md5').hexdigest()
+            # Python < 3.11: stream in chunks instead of reading the whole file
+            file_hash = hashlib.md5()
+            while chunk := f.read(HASH_CHUNK_BYTES):
+                file_hash.update(chunk)
+            return file_hash.hexdigest()
     
-    def _get_latest_book_file(self, book_files: List[Path]) -> Path:
-        return max(book_files, key=lambda f: f.stat().st_mtime)
+    def _get_latest_book_file(self, book_files: List[Path], stats: Dict[Path, os.stat_result]) -> Path:
+        return max(book_files, key=lambda f: stats[f].st_mtime)
     
-    def _group_files_by_book(self) -> Dict[str, List[Path]]:
+    def _enumerate_files(self) -> List[Tuple[Path, os.stat_result]]:
         if not self.pocketbook_path.exists():
             raise FileNotFoundError(f"PocketBook not mounted at {self.pocketbook_path}")
         
-        book_groups = {}
-        for html_file in self.pocketbook_path.glob("*.html"):
-            # Skip macOS metadata files
-            if html_file.name.startswith('._'):
+        files = []
+        # scandir reports the file type without an extra syscall per entry
+        with os.scandir(self.pocketbook_path) as entries:
+            for entry in entries:
+                # Skip macOS metadata files
+                if (not entry.name.endswith('.html') or entry.name.startswith('._')
+                        or not entry.is_file()):
+                    continue
+                files.append((Path(entry.path), entry.stat()))
+        return files
+    
+    def _cached_file(self, html_file: Path, stat: os.stat_result) -> Optional[Dict]:
+        """Cache entry of a file, if its mtime and size still match."""
+        cached = self.cache["files"].get(str(html_file))
+        if (cached and cached.get("mtime_ns") == stat.st_mtime_ns
+                and cached.get("size") == stat.st_size):
+            return cached
+        return None
+    
+    def _group_files_by_book(self, files: List[Tuple[Path, os.stat_result]]) -> Dict[str, List[Path]]:
+        cached_files = self.cache["files"]
+        # Every cached title was read from an <h1>
+        known_titles = {entry["title"] for entry in cached_files.values() if "title" in entry}
+        parsed_titles = {}
+        to_peek = []
+        for html_file, stat in files:
+            cached = self._cached_file(html_file, stat)
+            if cached and "title" in cached:
                 continue
-                
-            # Try to parse the file to get the title
-            try:
-                # Try different encodings
-                encodings = ['utf-8', 'cp1252', 'iso-8859-1', 'utf-16']
-                content = None
-                for encoding in encodings:
-                    try:
-                        content = html_file.read_text(encoding=encoding)
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                
-                if content is None:
-                    print(f"Warning: Could not read {html_file} with any encoding, skipping")
+            # PocketBook names files "<date> - <title>.html", but names can be
+            # mangled (characters the filesystem rejects, " (1)" suffixes,
+            # truncation), so the name only stands in for the <h1> when it
+            # matches the title of a book already seen
+            name_match = _RE_FILENAME_TITLE.match(html_file.stem)
+            if name_match and name_match.group(1).strip() in known_titles:
+                parsed_titles[html_file] = name_match.group(1).strip()
+            else:
+                to_peek.append(html_file)
+        parsed_titles.update(_parallel_map(_extract_title, to_peek))
+        
+        # Rebuilt from scratch so deleted files drop out of the cache
+        new_files = {}
+        book_groups = {}
+        for html_file, stat in files:
+            cached = cached_files.get(str(html_file))
+            if html_file in parsed_titles:
+                book_title = parsed_titles[html_file]
+                if book_title is None:
                     continue
-                    
-                soup = BeautifulSoup(content, 'lxml')
-                
-                title_elem = soup.find('h1') or soup.find('title')
-                if title_elem:
-                    book_title = title_elem.get_text(strip=True)
-                    # Remove date prefix if present
-                    if ' - ' in book_title:
-                        book_title = book_title.split(' - ', 1)[1]
+                if cached and "hash" in cached:
+                    # Keep the synced hash and stat until sync() has compared them
+                    cached = {**cached, "title": book_title}
                 else:
-                    book_title = html_file.stem
-                
-                if book_title not in book_groups:
-                    book_groups[book_title] = []
-                book_groups[book_title].append(html_file)
-            except Exception as e:
-                print(f"Error processing {html_file}: {e}")
-                continue
+                    cached = {
+                        "title": book_title,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "size": stat.st_size
+                    }
+            else:
+                book_title = cached["title"]
+            
+            new_files[str(html_file)] = cached
+            if book_title not in book_groups:
+                book_groups[book_title] = []
+            book_groups[book_title].append(html_file)
         
+        self.cache["files"] = new_files
         return book_groups
     
-    def _parse_highlights(self, filepath: Path) -> Tuple[str, str, List[Dict]]:
-        # Try different encodings
-        encodings = ['utf-8', 'cp1252', 'iso-8859-1', 'utf-16']
-        content = None
-        for encoding in encodings:
-            try:
-                content = filepath.read_text(encoding=encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        if content is None:
-            print(f"Warning: Could not read {filepath} with any encoding")
-            return filepath.stem, "Unknown Author", []
+    @staticmethod
+    def _try_parse_highlights(filepath: Path, size: int) -> Optional[Tuple[str, str, List[Dict]]]:
+        """Worker wrapper so one unreadable file doesn't abort the whole sync."""
+        try:
+            return PocketBookReadwiseSync._parse_highlights(filepath, size)
+        except Exception as e:
+            print(f"Error processing {filepath}: {e}")
+            return None
+    
+    @staticmethod
+    def _parse_highlights(filepath: Path, size: int) -> Tuple[str, str, List[Dict]]:
+        root = None
+        legacy = None
+        if size > LARGE_FILE_BYTES:
+            # Stream big UTF-8 files into lxml rather than holding the raw
+            # bytes, the decoded text and a re-encoded copy all at once
+            root = _parse_utf8_stream(filepath)
         
-        soup = BeautifulSoup(content, 'lxml')
+        if root is None:
+            content, legacy = _read_text(filepath)
+            try:
+                # lxml refuses str input that carries an XML encoding declaration,
+                # so hand it UTF-8 bytes and pin the parser to that encoding
+                root = LH.document_fromstring(content.encode('utf-8'), parser=_HTML_PARSER)
+            except etree.ParserError:
+                # Let BeautifulSoup's more forgiving parser build the tree instead
+                root = soupparser.fromstring(content)
         
         # Extract title and timestamp from h1, removing the date prefix
         highlighted_at = None
-        title_elem = soup.find('h1')
-        if title_elem:
-            title_text = title_elem.get_text(strip=True)
+        title_elems = _XP_H1(root)
+        if title_elems:
+            title_text = _get_text(title_elems[0])
             # Extract date and title from format: "2025-06-28 16:57:41 - Title"
-            if ' - ' in title_text:
-                date_part, title = title_text.split(' - ', 1)
-                try:
-                    # Parse the date and convert to ISO format
-                    dt = datetime.strptime(date_part, "%Y-%m-%d %H:%M:%S")
-                    highlighted_at = dt.isoformat() + "+00:00"
-                except ValueError:
-                    pass
+            date_match = _RE_DATE_TITLE.match(title_text)
+            if date_match:
+                date_part, title = date_match.groups()
+                if _is_calendar_date(date_part):
+                    # The format is fixed, so ISO 8601 is just a rearrangement
+                    highlighted_at = f"{date_part[:10]}T{date_part[11:19]}+00:00"
+            elif ' - ' in title_text:
+                # No usable date, but still drop whatever precedes the separator
+                title = title_text.split(' - ', 1)[1]
             else:
                 title = title_text
         else:
@@ -121,49 +396,50 @@ class PocketBookReadwiseSync:
         
         # Find author in the second bookmark div
         author = "Unknown Author"
-        bookmark_divs = soup.find_all('div', class_='bookmark')
+        bookmark_divs = _XP_BOOKMARKS(root)
         if len(bookmark_divs) >= 2:
-            author_text = bookmark_divs[1].find('span')
-            if author_text:
-                author = author_text.get_text(strip=True)
+            author_elems = _XP_SPAN(bookmark_divs[1])
+            if author_elems:
+                author = _get_text(author_elems[0])
         
         highlights = []
+        title_bytes = title.encode()
+        # Files in a declared non-UTF-8 charset were synced under IDs of the
+        # text as the old decoder misread it
+        legacy_title = _transcode(title, legacy) if legacy else None
         
         # Find all bookmark divs that contain highlights (not the title/author ones)
-        for div in soup.find_all('div', class_='bookmark'):
+        for div in bookmark_divs:
             if div.get('id'):  # Only process divs with IDs (actual highlights)
                 # Get highlight color
-                color_tag = None
-                for css_class in div.get('class', []):
-                    if css_class.startswith('bm-color-') and css_class != 'bm-color-none':
-                        # Extract the color name and format as a tag
-                        color_name = css_class.replace('bm-color-', '')
-                        color_tag = f".{color_name}"
-                        break
+                color_match = _RE_COLOR.search(div.get('class', ''))
+                color_tag = f".{color_match.group(1)}" if color_match else None
                 
                 # Get page number as integer
                 location = None
-                page_elem = div.find('p', class_='bm-page')
-                if page_elem:
-                    page_text = page_elem.get_text(strip=True)
+                page_elems = _XP_PAGE(div)
+                if page_elems:
+                    page_text = _get_text(page_elems[0])
                     try:
                         # Extract just the number from "page # 123" or similar formats
-                        page_match = re.search(r'\d+', page_text)
+                        page_match = _RE_DIGITS.search(page_text)
                         if page_match:
                             location = int(page_match.group())
                     except (ValueError, AttributeError):
                         pass
                 
                 # Get highlight text
-                text_elem = div.find('div', class_='bm-text')
-                if text_elem:
-                    text = text_elem.get_text(strip=True)
+                text_elems = _XP_TEXT(div)
+                if text_elems:
+                    text = _get_text(text_elems[0])
                     if text and len(text) > 10:
-                        highlight_id = hashlib.md5(f"{title}{text}".encode()).hexdigest()
+                        id_hash = hashlib.blake2b(title_bytes, digest_size=16)
+                        id_hash.update(text.encode())
+                        highlight_id = HIGHLIGHT_ID_PREFIX + id_hash.hexdigest()
                         
                         # Check for note
-                        note_elem = div.find('div', class_='bm-note')
-                        note = note_elem.get_text(strip=True) if note_elem else None
+                        note_elems = _XP_NOTE(div)
+                        note = _get_text(note_elems[0]) if note_elems else None
                         
                         # Add color tag to note if present
                         if color_tag:
@@ -172,13 +448,19 @@ class PocketBookReadwiseSync:
                             else:
                                 note = color_tag
                         
-                        highlights.append({
+                        highlight = {
                             "id": highlight_id,
                             "text": text,
                             "location": location,
                             "note": note,
                             "highlighted_at": highlighted_at
-                        })
+                        }
+                        if legacy_title is not None:
+                            legacy_text = _transcode(text, legacy)
+                            if legacy_text is not None:
+                                highlight["legacy_id"] = hashlib.md5(
+                                    f"{legacy_title}{legacy_text}".encode()).hexdigest()
+                        highlights.append(highlight)
         
         return title, author, highlights
     
@@ -207,72 +489,154 @@ class PocketBookReadwiseSync:
         
         return payload
     
+    def _migrate_legacy_id(self, title: str, highlight: Dict) -> bool:
+        """Check for the MD5 ID older versions used, upgrading it to the current one."""
+        legacy_id = highlight.get("legacy_id") or hashlib.md5(
+            f"{title}{highlight['text']}".encode()).hexdigest()
+        if legacy_id not in self.synced_ids:
+            return False
+        self.synced_ids.discard(legacy_id)
+        self.synced_ids.add(highlight["id"])
+        return True
+    
     def _send_to_readwise(self, highlights_data: List[Dict]) -> bool:
-        headers = {
-            "Authorization": f"Token {self.readwise_token}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {"highlights": highlights_data}
         
         try:
-            response = requests.post(self.readwise_url, json=payload, headers=headers)
+            response = self.session.post(self.readwise_url, json=payload, timeout=READWISE_TIMEOUT)
             response.raise_for_status()
             return True
         except requests.exceptions.RequestException as e:
             print(f"Error sending to Readwise: {e}")
             return False
     
+    def _flush_pending(self, pending: List[Tuple[str, Dict]],
+                       pending_files: List[Tuple[Path, Dict, int, bool]], final: bool = False):
+        """Upload queued highlights in batches and record the files they came from.
+        
+        Mid-run only whole batches are sent; the remainder stays queued so it
+        can be topped up by the next books.
+        """
+        count = len(pending) if final else len(pending) - len(pending) % READWISE_BATCH_SIZE
+        batches = [pending[i:i + READWISE_BATCH_SIZE] for i in range(0, count, READWISE_BATCH_SIZE)]
+        
+        # Requests are latency bound, so overlap a few of them
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            results = list(executor.map(
+                self._send_to_readwise,
+                [[payload for _, payload in batch] for batch in batches]
+            ))
+        
+        failed = []  # queue ranges of the batches that didn't go through
+        for start, batch, sent in zip(range(0, count, READWISE_BATCH_SIZE), batches, results):
+            if sent:
+                for highlight_id, _ in batch:
+                    self.synced_ids.add(highlight_id)
+                print(f"  Synced batch of {len(batch)} highlights")
+            else:
+                print(f"  Failed to sync batch of {len(batch)} highlights")
+                failed.append((start, start + len(batch)))
+        del pending[:count]
+        
+        # A file is done once every highlight queued for it has been sent, but
+        # it is only recorded if all of them made it; otherwise it is re-read
+        # next run and the failed ones are retried
+        still_queued = []
+        queue_start = 0
+        for latest_file, file_entry, queue_end, all_sent in pending_files:
+            if queue_start < queue_end and any(start < queue_end and queue_start < end
+                                               for start, end in failed):
+                all_sent = False
+            queue_start = queue_end
+            
+            if queue_end > count:
+                still_queued.append((latest_file, file_entry, queue_end - count, all_sent))
+            elif all_sent:
+                self.cache["files"][str(latest_file)] = file_entry
+                # Track the file as processed for potential cleanup
+                self.processed_files.append(latest_file)
+        pending_files[:] = still_queued
+    
     def sync(self):
         try:
-            book_groups = self._group_files_by_book()
+            html_files = self._enumerate_files()
+            stats = dict(html_files)
+            # Unchanged files are grouped from the cache without being read
+            book_groups = self._group_files_by_book(html_files)
             print(f"Found {len(book_groups)} unique books")
             
             total_new_highlights = 0
             
+            changed_books = []
             for book_title, files in book_groups.items():
-                latest_file = self._get_latest_book_file(files)
-                file_hash = self._get_file_hash(latest_file)
+                latest_file = self._get_latest_book_file(files, stats)
+                stat = stats[latest_file]
                 
-                cached_hash = self.cache["file_hashes"].get(str(latest_file))
-                if cached_hash == file_hash:
+                # Same mtime and size means unchanged; don't even read the file
+                cached = self._cached_file(latest_file, stat)
+                if cached and "hash" in cached:
                     print(f"Skipping '{book_title}' - no changes")
                     continue
                 
+                file_entry = {
+                    "hash": self._get_file_hash(latest_file),
+                    "title": book_title,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "size": stat.st_size
+                }
+                
+                if self.cache["files"][str(latest_file)].get("hash") == file_entry["hash"]:
+                    # Touched but not edited, remember the new mtime
+                    self.cache["files"][str(latest_file)] = file_entry
+                    print(f"Skipping '{book_title}' - no changes")
+                    continue
+                
+                changed_books.append((book_title, latest_file, file_entry))
+            
+            # Parse all changed files up front so they can be spread across cores
+            parsed_books = _parallel_map(
+                PocketBookReadwiseSync._try_parse_highlights,
+                [latest_file for _, latest_file, _ in changed_books],
+                [file_entry["size"] for _, _, file_entry in changed_books]
+            )
+            
+            # Highlights are queued across books so small books share requests
+            pending = []        # (highlight_id, payload)
+            pending_files = []  # (latest_file, file_entry, queue_end, all_sent) waiting on the queue
+            # synced_ids only grows at flush time, so also remember what is queued
+            queued_ids = set()
+            
+            for (book_title, latest_file, file_entry), parsed in zip(changed_books, parsed_books):
+                if parsed is None:
+                    # Not recorded in the cache, so it is retried next run
+                    print(f"\nSkipping '{book_title}' - could not be parsed")
+                    continue
+                
+                title, author, highlights = parsed
                 print(f"\nProcessing '{book_title}'...")
-                title, author, highlights = self._parse_highlights(latest_file)
                 
-                new_highlights = []
+                new_count = 0
                 for highlight in highlights:
-                    if highlight["id"] not in self.cache["synced_highlights"]:
+                    if (highlight["id"] not in self.synced_ids
+                            and highlight["id"] not in queued_ids
+                            and not self._migrate_legacy_id(title, highlight)):
                         payload = self._create_readwise_payload(title, author, highlight)
-                        new_highlights.append(payload)
+                        pending.append((highlight["id"], payload))
+                        queued_ids.add(highlight["id"])
+                        new_count += 1
                 
-                if new_highlights:
-                    print(f"  Found {len(new_highlights)} new highlights")
-                    
-                    batch_size = 100
-                    for i in range(0, len(new_highlights), batch_size):
-                        batch = new_highlights[i:i + batch_size]
-                        if self._send_to_readwise(batch):
-                            for j, h in enumerate(highlights[i:i + len(batch)]):
-                                self.cache["synced_highlights"][h["id"]] = {
-                                    "synced_at": datetime.now().isoformat(),
-                                    "book": title
-                                }
-                            print(f"  Synced batch of {len(batch)} highlights")
-                        else:
-                            print(f"  Failed to sync batch starting at highlight {i}")
-                    
-                    total_new_highlights += len(new_highlights)
+                if new_count:
+                    print(f"  Found {new_count} new highlights")
+                    total_new_highlights += new_count
                 else:
                     print(f"  No new highlights to sync")
                 
-                self.cache["file_hashes"][str(latest_file)] = file_hash
-                self._save_cache()
-                
-                # Track the file as processed for potential cleanup
-                self.processed_files.append(latest_file)
+                pending_files.append((latest_file, file_entry, len(pending), True))
+                # Wait for enough batches to keep every upload worker busy
+                if len(pending) >= READWISE_BATCH_SIZE * UPLOAD_WORKERS:
+                    self._flush_pending(pending, pending_files)
+            
+            self._flush_pending(pending, pending_files, final=True)
             
             print(f"\nSync complete! Uploaded {total_new_highlights} new highlights.")
             
@@ -281,6 +645,10 @@ class PocketBookReadwiseSync:
             print("Please ensure your PocketBook is connected and mounted at /Volumes/PB700K3/")
         except Exception as e:
             print(f"Unexpected error: {e}")
+        finally:
+            # Written once per run (even after an error) rather than per book,
+            # which kept rewriting the whole, ever-growing cache
+            self._save_cache()
     
     def cleanup(self):
         """Delete all HTML highlight files from the PocketBook device."""